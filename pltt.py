@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
+import pyarrow as pa
 import plotly.graph_objects as go
 import io
-import base64
+import hashlib
 from datetime import datetime
 
+# Copy-on-Write lets the frames below share memory until they are modified
+# (always enabled from pandas 3.0, where the option is deprecated)
+if int(pd.__version__.split('.')[0]) < 3:
+	pd.options.mode.copy_on_write = True
+
+# Line and area traces longer than this are downsampled before plotting
+MAX_TRACE_POINTS = 2000
+DOWNSAMPLED_POINTS = 1000
+
 # Set page configuration
 st.set_page_config(layout="wide", page_title="Interactive Plotly Animations")
 
@@ -19,35 +28,304 @@ You can visualize how your data changes over time or other sequences.
 
 
 # Function to download example data
+@st.cache_data
 def get_example_data():
 	# Create example data similar to stocks data
 	dates = pd.date_range(start='2020-01-01', periods=100)
 
-	# Create several columns with random but trending data
-	np.random.seed(42)
-	data = {
-		'date': dates,
-		'Company A': 100 + np.cumsum(np.random.randn(100) * 3),
-		'Company B': 150 + np.cumsum(np.random.randn(100) * 2),
-		'Company C': 200 + np.cumsum(np.random.randn(100) * 4),
-		'Company D': 120 + np.cumsum(np.random.randn(100) * 2.5),
-		'Company E': 180 + np.cumsum(np.random.randn(100) * 3.2),
-	}
+	# Create several columns with random but trending data, drawing all the
+	# random walks in a single call
+	rng = np.random.default_rng(42)
+	sigmas = np.array([3, 2, 4, 2.5, 3.2])
+	offsets = np.array([100, 150, 200, 120, 180])
+	walks = offsets + np.cumsum(rng.standard_normal((100, 5)) * sigmas, axis=0)
+
+	df = pd.DataFrame(walks, columns=['Company A', 'Company B', 'Company C', 'Company D', 'Company E'])
+	df.insert(0, 'date', dates)
+	return downcast_numeric(df)
+
 
-	df = pd.DataFrame(data)
+# Function to shrink integer columns to the smallest dtype holding their
+# values. Floats are left as they are, since float32 would change the values
+# shown in previews and hover labels.
+def downcast_numeric(df):
+	for col in df.select_dtypes(include=np.integer).columns:
+		df[col] = pd.to_numeric(df[col], downcast='integer')
 	return df
 
 
-# Function to create a download link for dataframe
-def get_download_link(df, filename="example_data.xlsx"):
+# Function to parse an uploaded Excel file, cached on the file contents for
+# the most recent uploads only
+@st.cache_data(max_entries=8)
+def load_excel(file_bytes, file_name):
+	# Legacy .xls files keep the default engine, everything else uses the
+	# much faster calamine reader when it is available
+	engine = None if file_name.lower().endswith('.xls') else 'calamine'
+	try:
+		df = pd.read_excel(io.BytesIO(file_bytes), engine=engine)
+	except (ImportError, ValueError):
+		if engine is None:
+			raise
+		df = pd.read_excel(io.BytesIO(file_bytes))
+	return downcast_numeric(df)
+
+
+# Function to group columns by kind in a single pass over the dtypes, cached
+# on the (column, dtype name) pairs
+@st.cache_data
+def classify_columns(dtypes):
+	numeric_cols, datetime_cols, text_cols = [], [], []
+	for col, dtype in dtypes:
+		if pd.api.types.is_datetime64_any_dtype(dtype):
+			datetime_cols.append(col)
+		elif pd.api.types.is_bool_dtype(dtype):
+			continue
+		elif pd.api.types.is_numeric_dtype(dtype):
+			numeric_cols.append(col)
+		elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+			text_cols.append(col)
+	return numeric_cols, datetime_cols, text_cols
+
+
+# Function to detect date columns, converting string columns where possible
+@st.cache_data(max_entries=8)
+def detect_datetime_columns(df, text_cols):
+	# Try to convert string columns to datetime
+	datetime_cols = []
+	for col in text_cols:
+		values = df[col].dropna()
+		if values.empty:
+			continue
+
+		# Skip columns that obviously hold plain text before parsing them
+		kind = pd.api.types.infer_dtype(values, skipna=True)
+		if kind == 'string':
+			if values.str.len().max() < 6 or not values.str.contains(r'\d').any():
+				continue
+		elif kind not in ('date', 'datetime'):
+			continue
+
+		try:
+			parsed = pd.to_datetime(df[col], errors='coerce')
+		except (TypeError, ValueError):
+			continue
+		# If most values parsed, convert column in dataframe
+		if parsed.notna().sum() > 0.9 * len(values):
+			df[col] = parsed
+			datetime_cols.append(col)
+	return df, datetime_cols
+
+
+# Function to convert the raw data preview to Arrow once per dataset, so
+# st.dataframe does not redo the pandas conversion on every rerun
+@st.cache_resource(max_entries=8)
+def get_preview(data_key, _df):
+	return pa.Table.from_pandas(_df.head())
+
+
+# Function to write the example data to an in-memory Excel file
+@st.cache_data
+def get_example_excel():
 	buffer = io.BytesIO()
-	with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-		df.to_excel(writer, index=False)
+	with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+		get_example_data().to_excel(writer, index=False)
+	return buffer.getvalue()
+
+
+# Function to pick n_out points that keep the visual shape of a series,
+# using the Largest-Triangle-Three-Buckets algorithm
+def lttb_indices(x, y, n_out):
+	n = len(y)
+	if n_out >= n or n_out < 3:
+		return np.arange(n)
+
+	# Work on float positions, dates become nanoseconds and labels their order
+	if np.issubdtype(x.dtype, np.datetime64):
+		x = x.astype('datetime64[ns]').astype('int64').astype('float64')
+	elif np.issubdtype(x.dtype, np.number):
+		x = x.astype('float64')
+	else:
+		x = np.arange(n, dtype='float64')
+	y = y.astype('float64')
+
+	# The first and last points are always kept, the rest is split in buckets
+	edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+	indices = np.empty(n_out, dtype=np.int64)
+	indices[0] = 0
+	indices[-1] = n - 1
+	a = 0
+	for i in range(n_out - 2):
+		lo, hi = edges[i], edges[i + 1]
+		if i + 2 < len(edges):
+			next_lo, next_hi = edges[i + 1], edges[i + 2]
+		else:
+			next_lo, next_hi = n - 1, n
+		avg_x = x[next_lo:next_hi].mean()
+		avg_y = y[next_lo:next_hi].mean()
+
+		# Keep the point forming the largest triangle with the previous pick
+		# and the average of the next bucket
+		area = np.abs(
+			(x[a] - avg_x) * (y[lo:hi] - y[a])
+			- (x[a] - x[lo:hi]) * (avg_y - y[a])
+		)
+		a = lo + int(np.argmax(area))
+		indices[i + 1] = a
+	return indices
+
+
+# Function to pick the rows kept for each y column when line or area traces
+# are too long to draw in full, or None to keep every row
+def downsample_indices(plot_type, df, x_col, y_cols):
+	if plot_type not in ("Line Chart", "Area Chart") or len(df) <= MAX_TRACE_POINTS:
+		return None
+	x = df[x_col].to_numpy()
+	if plot_type == "Area Chart":
+		# Stacked areas need the same x values in every trace
+		idx = lttb_indices(x, df[y_cols].sum(axis=1).to_numpy(), DOWNSAMPLED_POINTS)
+		return {col: idx for col in y_cols}
+	return {col: lttb_indices(x, df[col].to_numpy(), DOWNSAMPLED_POINTS) for col in y_cols}
+
+
+# Function to restrict downsampled rows to the first n rows, keeping the last
+# of them so the animation always ends on the current point. Frames short
+# enough to draw in full keep every row.
+def prefix_indices(indices, n):
+	if indices is None or n <= MAX_TRACE_POINTS:
+		return None
+	return {
+		col: np.append(idx[:np.searchsorted(idx, n - 1)], n - 1)
+		for col, idx in indices.items()
+	}
+
 
-	buffer.seek(0)
-	b64 = base64.b64encode(buffer.read()).decode()
-	href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">Download Example Excel File</a>'
-	return href
+# Function to create the traces of one animation frame as plain dicts
+def make_traces(plot_type, frame_df, x_col, y_cols, indices=None):
+	x = frame_df[x_col].to_numpy()
+
+	traces = []
+	for col in y_cols:
+		trace_x = x
+		trace_y = frame_df[col].to_numpy()
+		if indices is not None:
+			trace_x, trace_y = x[indices[col]], trace_y[indices[col]]
+
+		trace = {'x': trace_x, 'y': trace_y, 'name': col}
+		if plot_type == "Bar Chart":
+			trace['type'] = 'bar'
+		else:
+			trace['type'] = 'scatter'
+			if plot_type == "Line Chart":
+				trace['mode'] = 'lines+markers'
+			elif plot_type == "Scatter Plot":
+				trace['mode'] = 'markers'
+			elif plot_type == "Area Chart":
+				trace['mode'] = 'lines'
+				trace['stackgroup'] = 'one'
+		traces.append(trace)
+	return traces
+
+
+# Function to create the play/pause buttons and the frame slider
+def make_animation_controls(frame_names, animation_col):
+	def animate_args(duration):
+		return {
+			'frame': {'duration': duration, 'redraw': True},
+			'mode': 'immediate',
+			'fromcurrent': True,
+			'transition': {'duration': duration, 'easing': 'linear'}
+		}
+
+	updatemenus = [{
+		'type': 'buttons',
+		'direction': 'left',
+		'showactive': False,
+		'x': 0.1,
+		'xanchor': 'right',
+		'y': 0,
+		'yanchor': 'top',
+		'pad': {'r': 10, 't': 70},
+		'buttons': [
+			{'label': '&#9654;', 'method': 'animate', 'args': [None, animate_args(500)]},
+			{'label': '&#9724;', 'method': 'animate', 'args': [[None], animate_args(0)]}
+		]
+	}]
+	sliders = [{
+		'active': 0,
+		'currentvalue': {'prefix': f"{animation_col}="},
+		'len': 0.9,
+		'x': 0.1,
+		'xanchor': 'left',
+		'y': 0,
+		'yanchor': 'top',
+		'pad': {'b': 10, 't': 60},
+		'steps': [
+			{'label': name, 'method': 'animate', 'args': [[name], animate_args(0)]}
+			for name in frame_names
+		]
+	}]
+	return updatemenus, sliders
+
+
+# Function to build the animated figure. The animation speed is deliberately
+# not part of the cache key, it is patched onto a per-session copy instead.
+# Figures are shared across sessions and can be large, so only a few are kept.
+@st.cache_resource(max_entries=8)
+def build_figure(plot_type, x_col, y_cols, animation_frame, start, data_key, _df):
+	plot_df = _df
+	y_cols = list(y_cols)
+
+	# Create animation based on data points (like the example)
+	if animation_frame == "None" and pd.api.types.is_datetime64_any_dtype(plot_df[x_col]):
+		# Sort by date, with a stable sort so ties keep their file order
+		plot_df = plot_df.sort_values(by=x_col, kind='mergesort')
+
+	# Handle different animation cases
+	if animation_frame != "None":
+		# One frame per value of the selected animation column
+		animation_col = animation_frame
+		frame_dfs = (
+			(name, frame_df, downsample_indices(plot_type, frame_df, x_col, y_cols))
+			for name, frame_df in plot_df.groupby(animation_col, sort=False)
+		)
+	else:
+		# Frame i shows the first i rows. Every frame is a slice of the same
+		# data, so no row is copied per frame. Long series are downsampled
+		# once, so consecutive frames keep the same points.
+		animation_col = 'animation_frame'
+		indices = downsample_indices(plot_type, plot_df, x_col, y_cols)
+		frame_dfs = (
+			(i, plot_df.iloc[:i], prefix_indices(indices, i))
+			for i in range(start, len(plot_df) + 1)
+		)
+
+	# Build every frame from plain dicts so plotly does not validate each trace
+	frames = [
+		{'name': str(name), 'data': make_traces(plot_type, frame_df, x_col, y_cols, frame_indices)}
+		for name, frame_df, frame_indices in frame_dfs
+	]
+	updatemenus, sliders = make_animation_controls([frame['name'] for frame in frames], animation_col)
+
+	# Add title and labels
+	layout = {
+		'title': {'text': f"{plot_type} of {', '.join(y_cols)} over {x_col}"},
+		'xaxis': {'title': {'text': x_col}},
+		'yaxis': {'title': {'text': "Value"}},
+		'legend': {'title': {'text': "Variables"}},
+		'width': 1000,
+		'height': 600,
+		'updatemenus': updatemenus,
+		'sliders': sliders
+	}
+	if plot_type == "Bar Chart":
+		layout['barmode'] = 'relative'
+
+	return go.Figure(
+		data=frames[0]['data'] if frames else [],
+		layout=layout,
+		frames=frames,
+		_validate=False
+	)
 
 
 # Sidebar for data upload and selections
@@ -57,7 +335,12 @@ with st.sidebar:
 	# Option to download example data
 	st.subheader("Example Data")
 	example_df = get_example_data()
-	st.markdown(get_download_link(example_df), unsafe_allow_html=True)
+	st.download_button(
+		"Download Example Excel File",
+		data=get_example_excel(),
+		file_name="example_data.xlsx",
+		mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+	)
 
 	# File uploader
 	st.subheader("Upload Your Data")
@@ -65,7 +348,9 @@ with st.sidebar:
 
 	if uploaded_file is not None:
 		try:
-			df = pd.read_excel(uploaded_file)
+			file_bytes = uploaded_file.getvalue()
+			df = load_excel(file_bytes, uploaded_file.name)
+			data_key = hashlib.md5(file_bytes).hexdigest()
 			st.success("File successfully loaded!")
 		except Exception as e:
 			st.error(f"Error: {e}")
@@ -74,7 +359,8 @@ with st.sidebar:
 	else:
 		st.info("Or use example data below")
 		if st.button("Load Example Data"):
-			df = example_df.copy()
+			df = example_df
+			data_key = "example"
 		else:
 			df = None
 
@@ -82,22 +368,14 @@ with st.sidebar:
 if df is not None:
 	# Display raw data
 	st.subheader("Raw Data Preview")
-	st.dataframe(df.head())
+	st.dataframe(get_preview(data_key, df))
 
 	# Data columns analysis
-	numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
-	datetime_cols = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+	numeric_cols, datetime_cols, text_cols = classify_columns(
+		tuple(zip(df.columns, df.dtypes.astype(str)))
+	)
 	if not datetime_cols:
-		# Try to convert string columns to datetime
-		for col in df.columns:
-			if df[col].dtype == 'object':
-				try:
-					test_conversion = pd.to_datetime(df[col])
-					# If conversion was successful, convert column in dataframe
-					df[col] = test_conversion
-					datetime_cols.append(col)
-				except:
-					pass
+		df, datetime_cols = detect_datetime_columns(df, text_cols)
 
 	st.subheader("Data Visualization Settings")
 
@@ -165,88 +443,57 @@ if df is not None:
 		# Generate the visualization
 		st.subheader("Interactive Visualization")
 
-		# Handle different animation cases
+		# Keep only the plotted columns before building the animation
+		keep = [x_col, *selected_y_cols]
 		if animation_frame != "None":
-			# Use the selected animation frame
-			animation_col = animation_frame
-			plot_ready_df = df.copy()
-		else:
-			# Create animation based on data points (like the example)
-			if pd.api.types.is_datetime64_any_dtype(df[x_col]):
-				# Sort by date
-				df = df.sort_values(by=x_col)
-
-			# Create animation frames based on data index
-			start = start_point
-			obs = len(df)
-
-			# Create a new dataframe for animation
-			plot_ready_df = pd.DataFrame()
-			for i in np.arange(start, obs + 1):
-				dfa = df.head(i).copy()
-				dfa['animation_frame'] = i
-				plot_ready_df = pd.concat([plot_ready_df, dfa])
+			keep.append(animation_frame)
+		df_slim = df[list(dict.fromkeys(keep))]
 
-			animation_col = 'animation_frame'
-
-		# Create the appropriate plot based on selection
 		try:
-			if plot_type == "Line Chart":
-				fig = px.line(
-					plot_ready_df,
-					x=x_col,
-					y=selected_y_cols,
-					animation_frame=animation_col,
-					width=1000,
-					height=600,
-					markers=True
-				)
-			elif plot_type == "Scatter Plot":
-				fig = px.scatter(
-					plot_ready_df,
-					x=x_col,
-					y=selected_y_cols[0] if len(selected_y_cols) == 1 else selected_y_cols,
-					animation_frame=animation_col,
-					width=1000,
-					height=600,
-					size_max=15
+			# The figure is cached independently of the animation speed. Each
+			# session keeps its own copy until the selections change, so the
+			# speed can be patched without touching the shared figure.
+			fig_key = (plot_type, x_col, tuple(selected_y_cols), animation_frame, start_point, data_key)
+			if st.session_state.get('fig_key') != fig_key:
+				cached_fig = build_figure(
+					plot_type,
+					x_col,
+					tuple(selected_y_cols),
+					animation_frame,
+					start_point,
+					data_key,
+					df_slim
 				)
-			elif plot_type == "Bar Chart":
-				fig = px.bar(
-					plot_ready_df,
-					x=x_col,
-					y=selected_y_cols,
-					animation_frame=animation_col,
-					width=1000,
-					height=600
+				fig = go.Figure(
+					data=cached_fig.data,
+					layout=cached_fig.layout,
+					_validate=False
 				)
-			elif plot_type == "Area Chart":
-				fig = px.area(
-					plot_ready_df,
-					x=x_col,
-					y=selected_y_cols,
-					animation_frame=animation_col,
-					width=1000,
-					height=600
-				)
-
-			# Adjust animation settings
-			if hasattr(fig.layout, 'updatemenus') and fig.layout.updatemenus:
-				fig.layout.updatemenus[0].buttons[0]['args'][1]['frame']['redraw'] = True
-				fig.layout.updatemenus[0].buttons[0]['args'][1]['transition']['duration'] = animation_speed
-				fig.layout.updatemenus[0].buttons[0]['args'][1]['frame']['duration'] = animation_speed
-
-			# Add title and labels
-			fig.update_layout(
-				title=f"{plot_type} of {', '.join(selected_y_cols)} over {x_col}",
-				xaxis_title=x_col,
-				yaxis_title="Value",
-				legend_title="Variables"
+				# Only the layout is patched per session, so the frames are shared
+				# with the cached figure instead of being copied. Assigning
+				# fig.frames would deep-copy every frame.
+				fig._frame_objs = cached_fig._frame_objs
+				# Keep zoom and legend state in the browser for as long as the
+				# selections stay the same
+				fig.layout.uirevision = str(hash(fig_key))
+				st.session_state['fig_key'] = fig_key
+				st.session_state['fig'] = fig
+			fig = st.session_state['fig']
+
+			# Adjust animation speed on this session's figure
+			if fig.layout.updatemenus:
+				play_args = fig.layout.updatemenus[0].buttons[0]['args'][1]
+				play_args['transition']['duration'] = animation_speed
+				play_args['frame']['duration'] = animation_speed
+
+			# Display plot. A Figure is passed because Streamlit fully validates
+			# plain dicts before serializing them.
+			st.plotly_chart(
+				fig,
+				use_container_width=True,
+				config={'responsive': True, 'staticPlot': False}
 			)
 
-			# Display plot
-			st.plotly_chart(fig, use_container_width=True)
-
 			# Add description for controls
 			st.info("""
             **Animation Controls:**